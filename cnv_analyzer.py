@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import sys, os, errno
+import sys, os, errno, mmap
 from scripts.exceptions import *
 from scripts.args import *
 from inspect import getfullargspec
-from re import search, sub, compile, split
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
 
+@dataclass
+class cnv_stats:
+    """Summary numbers of the cnv's kept by vcf_parser, filled in while parsing."""
+
+    total: int
+    dup_n: int
+    del_n: int
+    dup_quals: np.ndarray
+    del_quals: np.ndarray
+
 class vcf_parser:
     """Parse a .cnv.vcf file generated by the Dragen CNV pipeline.
     """
@@ -24,11 +35,11 @@ class vcf_parser:
         self.out = out
         self._to_csv = _to_csv 
 
+    _params = tuple(p for p in getfullargspec(__init__).args if p != "self")
+
     @classmethod
     def __repr__(cls) -> str:
-        params = getfullargspec(__class__).args
-        params.remove("self")
-        return params
+        return list(cls._params)
 
     @classmethod
     def __dir__(cls, only_added = False) -> list:
@@ -43,7 +54,7 @@ class vcf_parser:
         if not only_added:
             return all_att
         else:
-            default_atts = ['__module__', '__doc__', '__dict__', '__weakref__']
+            default_atts = ['__module__', '__doc__', '__dict__', '__weakref__', '_params']   # _params is internal to __repr__.
             all_att = [x for x in all_att if x not in default_atts]
             return all_att
 
@@ -59,128 +70,135 @@ class vcf_parser:
         """
         raise NoCnvFoundError(f"Unable to find any cnv's in file: {f}. File must contain at least one of the following cnv's: {', '.join(cls.cnvs)}")
 
-    def cnv_line_finder(self) -> tuple[list, str]:
-        """Finds all the lines in a .vcf file that contain cnv's.
+    def cnv_line_finder(self) -> tuple[list, str, str]:
+        """Finds all the lines in a .vcf file that contain the requested cnv's and splits them into their columns.
 
         Raises:
             * `RuntimeError`: Raised when the script is unable to find the first chromosome entry. Potential compatibility issue with the .vcf file.
             * `NoCnvFoundError`: No cnv's are present in the .vcf file.
 
         Returns:
-            `tuple`: List of all the lines with cnv entries, string equal to the name of the sample.
+            `tuple`: List of the tab separated fields of every cnv entry, string equal to the name of the sample, reference line.
         """
 
-        with open(self.vcf_fl, "r") as vcf:
+        chr_err = "Unable to locate the first chromosome entry. Every chromosome entry must start with the chr character."
+        if os.path.getsize(self.vcf_fl) == 0:   # An empty file cannot be memory-mapped.
+            raise RuntimeError(chr_err)
+
+        with open(self.vcf_fl, "rb") as vcf, mmap.mmap(vcf.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):    # Not available on every platform (e.g. Windows).
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+
+            ref = sample = ""
+            pos = 0
+            while mm[pos:pos + 1] == b"#":
+                eol = mm.find(b"\n", pos)
+                if eol == -1:
+                    eol = len(mm)
+                line = mm[pos:eol]
+                if line.startswith(b"##reference"):
+                    ref = line.decode().rstrip()
+                elif line.startswith(b"#CHROM"):
+                    sample = line.decode().rstrip().rpartition("\t")[2]
+                pos = eol + 1
+            has_chr = mm[pos:pos + 3] == b"chr" or mm.find(b"\nchr", pos) != -1
+
+            # Tags of a cnv type the user excluded are never searched for, unless a single entry
+            # was asked for: -inf looks up entries of either type.
+            if not self.disp_info == None:
+                tags = (b"<DUP>", b"<DEL>")
+            elif self.find_only_dups:
+                tags = (b"<DUP>",)
+            elif self.find_only_dels:
+                tags = (b"<DEL>",)
+            else:
+                tags = (b"<DUP>", b"<DEL>")
+
+            # Jump from one cnv tag to the next and only slice out the lines they sit on.
             out_lst = []
-            counter = 0
-            for line in vcf:
-                line = line.rstrip()
-                if search('#reference', line):
-                    ref = str(line)
-                if "#CHROM" in line:
-                    sample = line.split("\t")[-1]
-                if not line[0:3] == "chr":
-                    continue
-                counter += 1
-                if "<DUP>" in line or "<DEL>" in line:
-                    out_lst.append(line)
-
-        if counter == 0:
-            raise RuntimeError("Unable to locate the first chromosome entry. Every chromosome entry must start with the chr character.")
+            hits = [mm.find(tag, pos) for tag in tags]
+            while any(p != -1 for p in hits):
+                hit = min(p for p in hits if p != -1)
+                start = mm.rfind(b"\n", 0, hit) + 1
+                end = mm.find(b"\n", hit)
+                if end == -1:
+                    end = len(mm)
+                if mm.find(b"chr", start, start + 3) == start:
+                    out_lst.append(mm[start:end].decode().rstrip("\r").split("\t"))  # Only \r is stripped, so empty trailing cells are kept.
+                hits = [mm.find(tag, end) if p != -1 and p < end else p for tag, p in zip(tags, hits)]
+
+        if not has_chr:
+            raise RuntimeError(chr_err)
         if not len(out_lst) > 0:
             return self.raise_cnv_err(f = self.vcf_fl)
 
         return out_lst, sample, ref
 
-    @staticmethod
-    def _add_to_df(iter: str, d: pd.DataFrame) -> bool:
-        """Add iterable to dataframe
-
-        Args:
-            * `iter` (str): Iterable.
-            * `d` (pd.DataFrame): Input dataframe for result insertion.
-
-        Returns:
-            `bool`: True if operation is successful.
-        """
-
-        row_no_tabs = iter.replace('\t', " ").split(" ")
-        d.loc[len(d)] = row_no_tabs
-        return True
-
-    def _info_parser(self) -> (tuple[pd.DataFrame, dict, str] | tuple[pd.DataFrame, str]):
+    def _info_parser(self) -> tuple[pd.DataFrame, cnv_stats, dict | None, str]:
         """Parse through each element in the list generated by the cnv_line_finder function and insert it
         into a pandas dataframe.
 
         Raises:
             * `TypeError`: Raised when disp_info is a string that is not of base 10.
+            * `InputflError`: Raised when a cnv entry does not have one column per header field (e.g. multi-sample files).
 
         Returns:
-            `tuple`: Either a tuple with the pandas dataframe, single entry dictionary and the reference file name or
-            a tuple with the pandas dataframe, and the reference file name if a single entry is not specified.
+            `tuple`: The pandas dataframe, summary stats, single entry dictionary (None if no single entry was found)
+            and the reference file name.
         """
 
-        lst_of_cnv_lines, sample, ref = self.cnv_line_finder()
+        if not self.disp_info == None and not self.disp_info.isdigit():
+            raise TypeError(f"-inf argument must be an integer. {self.disp_info} is not an integer.")
+        look_up = self.disp_info
+
+        cnv_entries, sample, ref = self.cnv_line_finder()
         indv_entities = {}  # fill with whatever the user asks for. Only use for one call that depends on specific start or end. give back the full line. Each element is 1 cell. 
-        df = pd.DataFrame([[0,0,0,0,0,0,0,0,0,0]], columns = ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", sample])
-        for i in lst_of_cnv_lines:
-            chrom = compile(r"^[^\t]*")
-            chrom = search(chrom, i).group(0)
-            startpos = split("\t+", i)
-            start = []
-            counter = 0
-            for pos in startpos:
-                if pos.isdigit() and counter == 0:  # Counter is only equal to 0 when the start has not been found, once it gets found this block doesn't run again.
-                    start.append(pos)
-                    start = "".join(start)
-                    counter += 1
-
-                if "DRAGEN:" in pos:
-                    start_end = sub("[^0-9]", ", ", pos)
-                    start_end = start_end.replace(",","").strip()
-                    whitespace_sep = compile(r"^[^ ]*")
-                    start_end = start_end.split(" ", 1)[1]
-                    start_ref = search(whitespace_sep, start_end).group(0)  # start and end will be shown at the end for specific calls.
-                    end = sub(start_ref, "", start_end).strip()
-                    if not self.disp_info == None:  # User did not request specific info:
-                        if self.disp_info.isdigit() and (self.disp_info == start or self.disp_info == end):
-                            indv_entities["sample"] = sample
-                            indv_entities["chromosome"] = chrom
-                            indv_entities["start"] = start
-                            indv_entities["end"] = end
-                            if "<DUP>" in i:
-                                indv_entities["cnv_type"] = "<DUP>"
-                            elif "<DEL>" in i:
-                                indv_entities["cnv_type"] = "<DEL>"
-                            qc_score = i.split(end, 1)[1]
-                            qc_score = qc_score.split("SVLEN", 1)[0]
-                            qc_score = sub("[^0-9]", "", qc_score).strip()
-                            indv_entities["score"] = qc_score
-                            if "cnvQual" in i:
-                                indv_entities["filter"] = "cnvQual"
-                            elif "PASS" in i:
-                                indv_entities["filter"] = "PASS"
-
-                        if not self.disp_info.isdigit():
-                            raise TypeError(f"-inf argument must be an integer. {self.disp_info} is not an integer.")
-                else:
-                    continue
+        rows = []
+        columns = ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", sample]
+        for fields in cnv_entries:
+            cnv_type = fields[4]    # ALT column.
+
+            if not look_up == None and fields[2].startswith("DRAGEN:"):
+                start = fields[1]   # POS column.
+                # ID field has the fixed shape DRAGEN:<TYPE>:<chrom>:<start>-<end>.
+                _, _, end = fields[2].rpartition(":")[2].partition("-")  # Only the end is needed, the start is POS.
+                if look_up == start or look_up == end:
+                    indv_entities["sample"] = sample
+                    indv_entities["chromosome"] = fields[0]
+                    indv_entities["start"] = start
+                    indv_entities["end"] = end
+                    indv_entities["cnv_type"] = cnv_type
+                    indv_entities["score"] = fields[5]  # QUAL column.
+                    indv_entities["filter"] = fields[6]
+                    look_up = None
 
             if self.find_only_dups:
-                if "<DUP>" in i:
-                    self._add_to_df(iter = i, d = df)
+                keep = cnv_type == "<DUP>"
             elif self.find_only_dels:
-                if "<DEL>" in i:
-                    self._add_to_df(iter = i, d = df)
-            elif not (self.find_only_dups and self.find_only_dels):
-                if "<DUP>" in i or "<DEL>" in i:
-                    self._add_to_df(iter = i, d = df)
-
-        df = df.iloc[1: , :]    # Removes the first place-holder row.
-        if len(indv_entities) > 0:
-            return df, indv_entities, ref
-        else:
-            return df, ref
+                keep = cnv_type == "<DEL>"
+            else:
+                keep = cnv_type in self.cnvs
+            if keep:
+                if not len(fields) == len(columns):     # Rows are transposed with zip below, which would silently truncate.
+                    raise InputflError(f"cnv entry {fields[0]}:{fields[1]} has {len(fields)} columns, expected {len(columns)}. "
+                                    "Only single-sample .vcf files are supported.")
+                rows.append(fields)
+
+        # Transpose the rows into one sequence per column: POS and QUAL as integer arrays, ALT and FILTER as categoricals.
+        cols = dict(zip(columns, zip(*rows))) if rows else dict.fromkeys(columns, ())
+        cols["POS"] = np.asarray(cols["POS"], dtype = np.int64)
+        cols["QUAL"] = np.asarray(cols["QUAL"], dtype = np.int32)
+        cols["ALT"] = pd.Categorical(cols["ALT"], categories = self.cnvs)
+        cols["FILTER"] = pd.Categorical(cols["FILTER"])
+        df = pd.DataFrame(cols, columns = columns, index = range(1, len(rows) + 1))  # Report index starts at 1.
+
+        # ALT codes follow the order of self.cnvs: 0 is <DUP>, 1 is <DEL>.
+        qual_arr = df["QUAL"].to_numpy()
+        codes = df["ALT"].cat.codes.to_numpy()
+        dup_n, del_n = np.bincount(codes, minlength = 2)
+        stats = cnv_stats(total = len(rows), dup_n = int(dup_n), del_n = int(del_n),
+                        dup_quals = qual_arr[codes == 0], del_quals = qual_arr[codes == 1])
+        return df, stats, indv_entities or None, ref
 
     def _stats_writer(self) -> bool:
         """Write the results in a .txt file and a .csv file. Summary information
@@ -193,152 +211,106 @@ class vcf_parser:
             `bool`: True if operation is successful.
         """
 
-        if self.disp_info:
-            try:
-                df, single_entry, ref = self._info_parser()
-            except ValueError:
-                raise NotCnvError(f"User entry might not be a cnv. Check if entry {self.disp_info} is a cnv.")
-        else:
-            single_entry = None
-            df, ref = self._info_parser()
+        df, stats, single_entry, ref = self._info_parser()
+        if self.disp_info and single_entry == None:
+            raise NotCnvError(f"User entry might not be a cnv. Check if entry {self.disp_info} is a cnv.")
 
         ref = ref.replace("reference=","")
         ref = ref.replace("#","")
         # To be used in description.
-        num_of_df_entries = len(df.index)   # Number of CNV's
+        num_of_df_entries = stats.total   # Number of CNV's
 
         ## cnv's
-        all_cnvs = df["ALT"].value_counts()
+        dup_quals, del_quals = stats.dup_quals, stats.del_quals
 
-        def __max(dframe: pd.DataFrame) -> str:
-            """Internal function to calculate the maximum quality score in the QUAL column.
+        def __max(qual_arr: np.ndarray) -> str:
+            """Internal function to calculate the maximum quality score of a cnv type.
 
             Args:
-                * `dframe` (str): Dataframe to load.
+                * `qual_arr` (np.ndarray): QUAL scores of a cnv type.
 
             Returns:
                 `str`: The maximum value as a string.
             """
 
-            qual_vals = dframe["QUAL"].tolist()
-            qual_vals = [int(x) for x in qual_vals]
-            return str(max(qual_vals))
+            return str(qual_arr.max())
 
-        def __min(dframe):
-            """Internal function to calculate the minimum quality score in the QUAL column.
+        def __min(qual_arr: np.ndarray) -> str:
+            """Internal function to calculate the minimum quality score of a cnv type.
 
             Args:
-                * `dframe` (str): Dataframe to load.
+                * `qual_arr` (np.ndarray): QUAL scores of a cnv type.
 
             Returns:
                 `str`: The minimum value as a string.
             """
 
-            qual_vals = dframe["QUAL"].tolist()
-            qual_vals = [int(x) for x in qual_vals]
-            return str(min(qual_vals))
+            return str(qual_arr.min())
 
+        have_dup, have_del = stats.dup_n > 0, stats.del_n > 0  # An absent cnv type has no scores, its min/max are None.
         if self.find_only_dups:
-            ent_index = ["DUPS"]
-            all_cnvs.index = ent_index
-            num_of_df_dups = str(all_cnvs.get(key = "DUPS"))
+            num_of_df_dups = str(stats.dup_n)
             num_of_df_dels = None
-            max_qual_dups = __max(dframe = df)
+            max_qual_dups = __max(qual_arr = dup_quals) if have_dup else None
             max_qual_dels = None
-            min_qual_dups = __min(dframe = df)
+            min_qual_dups = __min(qual_arr = dup_quals) if have_dup else None
             min_qual_dels = None
         elif self.find_only_dels:
-            ent_index = ["DELS"]
-            all_cnvs.index = ent_index
             num_of_df_dups = None
-            num_of_df_dels = str(all_cnvs.get(key = "DELS"))
-            qual_vals = df["QUAL"].tolist()
-            qual_vals = [int(x) for x in qual_vals]
+            num_of_df_dels = str(stats.del_n)
             max_qual_dups = None
-            max_qual_dels = __max(dframe = df)
+            max_qual_dels = __max(qual_arr = del_quals) if have_del else None
             min_qual_dups = None
-            min_qual_dels = __min(dframe = df)
+            min_qual_dels = __min(qual_arr = del_quals) if have_del else None
         else:
-            ent_index = ["DUPS", "DELS"]
-            all_cnvs.index = ent_index
-            num_of_df_dups = str(all_cnvs.get(key = "DUPS"))
-            num_of_df_dels = str(all_cnvs.get(key = "DELS"))
+            num_of_df_dups = str(stats.dup_n)
+            num_of_df_dels = str(stats.del_n)
 
             # Get max, min for both DUP and DEL in .vcf
-            temp_df = df.filter(['ALT', 'QUAL'])
-            dups_df = temp_df[temp_df.ALT != '<DEL>']
-            dels_df = temp_df[temp_df.ALT != '<DUP>']
-            max_qual_dups = __max(dframe = dups_df)
-            max_qual_dels = __max(dframe = dels_df)
-            min_qual_dups = __min(dframe = dups_df)
-            min_qual_dels = __min(dframe = dels_df)
-
-        ## Scores
-        if num_of_df_dups == None:
-            dups_score = None
-            dels_score = df["QUAL"].value_counts().describe()
-        if num_of_df_dels == None:
-            dups_score = df["QUAL"].value_counts().describe()
-            dels_score = None
-        if "<DEL>" and "<DUP>" in set(df["ALT"]):
-            df_scores = df.loc[:, df.columns.intersection(['ALT','QUAL'])]
-            df_dups = df_scores.loc[df['ALT'] == "<DUP>"].drop(columns = 'ALT')
-            df_dels = df_scores.loc[df['ALT'] == "<DEL>"].drop(columns = 'ALT')
-            dups_score = df_dups["QUAL"].value_counts().describe()
-            dels_score = df_dels["QUAL"].value_counts().describe()
-
-
-        def __count_cnv(score: pd.Series):
-            """Internal function to count the number of a specified cnv.
-
-            Args:
-                score (pd.Series): A column from a pandas Series.
-
-            Returns:
-                str: The number of occurances of a cnv rounded to 0 decimal places.
-            """
-
-            _count = list(score.loc[['count']])
-            _count = ''.join([str(c) for c in _count])
-            return str(int(float(_count)))
+            max_qual_dups = __max(qual_arr = dup_quals) if have_dup else None
+            max_qual_dels = __max(qual_arr = del_quals) if have_del else None
+            min_qual_dups = __min(qual_arr = dup_quals) if have_dup else None
+            min_qual_dels = __min(qual_arr = del_quals) if have_del else None
 
         command_used = ' '.join(sys.argv[0:])
-        with open(self.out, "w") as txt:
-            txt.write('Copy Number Variant Analyzer\n\n')
-            txt.write('This file was produced with the cnv_analyzer python tool.\n\n')
-            txt.write(f'Command used: {command_used}.\n\n\n')
-            txt.write('\t\t\t\t####Summary of analysis#####\n\n')
-            txt.write(f'Reference used: {ref}\n\n')
+        report = []
+        report.append('Copy Number Variant Analyzer\n\n')
+        report.append('This file was produced with the cnv_analyzer python tool.\n\n')
+        report.append(f'Command used: {command_used}.\n\n\n')
+        report.append('\t\t\t\t####Summary of analysis#####\n\n')
+        report.append(f'Reference used: {ref}\n\n')
+
+        report.append("The analyzer looked for the following types of cnv's: ")
+        if self.find_only_dups:
+            report.append('DUP\n')
+        if self.find_only_dels:
+            report.append('DEL\n')
+        if not (self.find_only_dups and self.find_only_dels):
+            report.append('DUP, DEL\n')
+        report.append(f"Total number of CNV's: {num_of_df_entries}\n")
 
-            txt.write("The analyzer looked for the following types of cnv's: ")
-            if self.find_only_dups:
-                txt.write('DUP\n')
-            if self.find_only_dels:
-                txt.write('DEL\n')
-            if not (self.find_only_dups and self.find_only_dels):
-                txt.write('DUP, DEL\n')
-            txt.write(f"Total number of CNV's: {num_of_df_entries}\n")
-
-            if num_of_df_dups == None:
-                txt.write(f'Number of deletion entries found: {num_of_df_dels}\n')
-                txt.write(f'Maximum quality score of deletion entries: {max_qual_dels}\n')
-                txt.write(f'Minimum quality score of deletion entries: {min_qual_dels}\n')
-            elif num_of_df_dels == None:
-                txt.write(f'Number of duplication entries: {num_of_df_dups}\n')
-                txt.write(f'Maximum quality score of deletion entries: {max_qual_dups}\n')
-                txt.write(f'Minimum quality score of deletion entries: {min_qual_dups}\n')
-            else:
-                txt.write(f'Number of duplication entries: {num_of_df_dups}\n')
-                txt.write(f'Number of deletion entries: {num_of_df_dels}\n')
-                txt.write(f'Maximum quality score of duplication entries: {max_qual_dups}\n')
-                txt.write(f'Minimum quality score of duplication entries: {min_qual_dups}\n')
-                txt.write(f'Maximum quality score of deletion entries: {max_qual_dels}\n')
-                txt.write(f'Minimum quality score of deletion entries: {min_qual_dels}\n')
-
-            txt.write(f"\nChromosomes with cnv's present: {', '.join(df.CHROM.unique())}\n\n")
-            txt.write(f"Tab delimited columns containing only the cnv's found in file: {os.path.basename(self.vcf_fl)}\n\n")
-            txt.write('Index')
-            df.to_csv(txt, sep='\t', mode='a')
+        if num_of_df_dups == None:
+            report.append(f'Number of deletion entries found: {num_of_df_dels}\n')
+            report.append(f'Maximum quality score of deletion entries: {max_qual_dels}\n')
+            report.append(f'Minimum quality score of deletion entries: {min_qual_dels}\n')
+        elif num_of_df_dels == None:
+            report.append(f'Number of duplication entries: {num_of_df_dups}\n')
+            report.append(f'Maximum quality score of deletion entries: {max_qual_dups}\n')
+            report.append(f'Minimum quality score of deletion entries: {min_qual_dups}\n')
+        else:
+            report.append(f'Number of duplication entries: {num_of_df_dups}\n')
+            report.append(f'Number of deletion entries: {num_of_df_dels}\n')
+            report.append(f'Maximum quality score of duplication entries: {max_qual_dups}\n')
+            report.append(f'Minimum quality score of duplication entries: {min_qual_dups}\n')
+            report.append(f'Maximum quality score of deletion entries: {max_qual_dels}\n')
+            report.append(f'Minimum quality score of deletion entries: {min_qual_dels}\n')
+
+        report.append(f"\nChromosomes with cnv's present: {', '.join(df.CHROM.unique())}\n\n")
+        report.append(f"Tab delimited columns containing only the cnv's found in file: {os.path.basename(self.vcf_fl)}\n\n")
+        report.append('Index')
+        report.append(df.to_csv(sep = '\t', lineterminator = '\n'))   # Text mode translates the newlines on write.
+        with open(self.out, "w") as txt:
+            txt.write(''.join(report))
 
         # Write dataframe to csv.
         if self._to_csv:
@@ -23,6 +23,9 @@ def args_parser(msg) -> argparse.Namespace:
     parser.add_argument("-csv", help = "Optional argument: Output findings as a .csv, default is True.")
     return parser.parse_args()
 
+_TRUE = frozenset({"true", "True", "1"})
+_FALSE = frozenset({"false", "False", "0", None})
+
 def bool_parser(var: any) -> bool:
     """Check if parameter is boolean, if not, convert it to boolean.
     Args:
@@ -35,14 +38,12 @@ def bool_parser(var: any) -> bool:
         boolean: True if var is boolean, False if not.
     """
 
-    _true = ["true", "True", "1"]
-    _false = ["false", "False", "0", None]
-    if type(var) == bool:
+    if isinstance(var, bool):
         return var
     else:
-        if var in _true:
+        if var in _TRUE:
             return True
-        elif var in _false:
+        elif var in _FALSE:
             return False
         else:
             raise TypeError(f"{var} must be true, True, 1, False, false, 0 or None.")
\ No newline at end of file